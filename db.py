@@ -1,6 +1,9 @@
 import os
+import threading
+from contextlib import contextmanager
 from dotenv import load_dotenv
 import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
 
 # Load environment variables from .env file
 load_dotenv()
@@ -10,13 +13,53 @@ DB_USER = os.getenv("DB_USER", "default_user")
 DB_PASSWORD = os.getenv("DB_PASSWORD", "default_password")
 DB_HOST = os.getenv("DB_HOST", "localhost")
 
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+def _get_pool():
+    """
+    Lazily create the shared connection pool on first use.
+    """
+    global _POOL
+    if _POOL is None:
+        with _POOL_LOCK:
+            if _POOL is None:
+                _POOL = ThreadedConnectionPool(
+                    1, 8,
+                    dbname=DB_NAME,
+                    user=DB_USER,
+                    password=DB_PASSWORD,
+                    host=DB_HOST
+                )
+    return _POOL
+
+def _getconn_checked(pool):
+    """
+    Borrow a connection from the pool and make sure it still works. After a
+    PostgreSQL restart every idle pooled connection is dead, so broken ones
+    are discarded until a working or newly opened connection comes back.
+    """
+    for _ in range(pool.maxconn):
+        conn = pool.getconn()
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+            conn.rollback()
+            return conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            pool.putconn(conn, close=True)
+    return pool.getconn()
+
+@contextmanager
 def get_db_connection():
     """
-    Returns a new connection to the PostgreSQL database.
+    Borrows a connection to the PostgreSQL database from the shared pool for
+    the duration of the with-block. Any open transaction is rolled back when
+    the connection is returned.
     """
-    return psycopg2.connect(
-        dbname=DB_NAME,
-        user=DB_USER,
-        password=DB_PASSWORD,
-        host=DB_HOST
-    )
+    pool = _get_pool()
+    conn = _getconn_checked(pool)
+    try:
+        yield conn
+    finally:
+        pool.putconn(conn, close=bool(conn.closed))
\ No newline at end of file
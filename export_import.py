@@ -1,9 +1,22 @@
 import os
+import io
 import json
 import logging
+import re
+import struct
+import threading
+from itertools import islice, zip_longest
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import ijson
+from ijson.common import ObjectBuilder
+import numpy as np
+import orjson
 import psycopg2
-from psycopg2.extras import execute_values
+from psycopg2.errors import FeatureNotSupported, InsufficientPrivilege
+from psycopg2.extras import execute_batch, register_default_jsonb
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from dotenv import load_dotenv
 from db import get_db_connection
 
@@ -27,6 +40,41 @@ CHROMADB_HOST = os.getenv("CHROMADB_HOST", "localhost")
 CHROMADB_PORT = int(os.getenv("CHROMADB_PORT", 8000))
 CHROMADB_USE_SSL = os.getenv("CHROMADB_USE_SSL", "False").lower() in ("true", "1", "yes")
 
+# Embedding storage format for new exports: unset for float32, "int8" for
+# scaled int8 vectors. Each stored value is tagged with its format, so the
+# setting can change between exports and does not matter for imports.
+BACKUP_QUANTIZE = os.getenv("BACKUP_QUANTIZE", "").lower()
+
+# Export paging: when EXPORT_PAGE_SIZE > 0 the collection is fetched with
+# offset/limit pages, EXPORT_WORKERS of them in flight at once.
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE") or 0)
+EXPORT_WORKERS = int(os.getenv("EXPORT_WORKERS") or 8)
+
+# Incremental export: name of a metadata field holding a monotonically
+# increasing modification timestamp. When set, the highest value seen is
+# stored in the backup_state table and later exports only ask the API for
+# records with ?modified_since=<that value>. Unset means a full scan.
+EXPORT_WATERMARK_KEY = os.getenv("EXPORT_WATERMARK_KEY", "")
+
+# Statements per round trip for the execute_batch upsert used when COPY is
+# not available to the backup user.
+UPSERT_PAGE_SIZE = int(os.getenv("UPSERT_PAGE_SIZE") or 1000)
+
+# Number of records sent per add_embeddings request during an import, and
+# how many of those requests may be in flight at once.
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE") or 1000)
+IMPORT_WORKERS = int(os.getenv("IMPORT_WORKERS") or 4)
+
+# Shared HTTP session so connections to the vector DB API are kept alive and
+# reused across exports, imports and health checks. requests already sends
+# Accept-Encoding: gzip, deflate, so embedding responses arrive compressed
+# whenever the server supports it.
+_SESSION = requests.Session()
+_SESSION.headers.update({"accept": "application/json"})
+_ADAPTER = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=Retry(total=3, backoff_factor=0.2))
+_SESSION.mount("http://", _ADAPTER)
+_SESSION.mount("https://", _ADAPTER)
+
 def get_base_url():
     """
     Construct the base URL from the environment configuration.
@@ -37,199 +85,571 @@ def get_base_url():
         return f"{scheme}://{CHROMADB_HOST}"
     return f"{scheme}://{CHROMADB_HOST}:{CHROMADB_PORT}"
 
-def get_backup_ids():
+# Endpoint URLs only depend on the environment, so build them once.
+_BASE_URL = get_base_url()
+_GET_URL = f"{_BASE_URL}/api/v1/vector_db/collections/{CHROMA_COLLECTION_NAME}/embeddings"
+_CREATE_URL = f"{_BASE_URL}/api/v1/vector_db/collections"
+_ADD_URL = f"{_BASE_URL}/api/v1/vector_db/collections/{NEW_COLLECTION_NAME}/add_embeddings"
+
+# orjson cannot serialize integers beyond 64 bits and parses them as floats.
+# JSON text containing a digit run that long goes through the stdlib instead,
+# which keeps such values exact.
+_LONG_DIGITS = re.compile(r"\d{19}")
+
+def _json_dumps(value):
     """
-    Fetch the set of IDs already backed up in the PostgreSQL table.
-    If the table doesn't exist yet, return an empty set.
+    Serialize value to JSON bytes with orjson, falling back to the stdlib json
+    module for integers orjson cannot represent.
     """
-    backup_ids = set()
-    conn = None
-    cur = None
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute(f"SELECT id FROM {BACKUP_TABLE};")
-        rows = cur.fetchall()
-        backup_ids = set(row[0] for row in rows)
-        logging.info(f"Fetched {len(backup_ids)} backup IDs from table '{BACKUP_TABLE}'.")
-    except Exception as e:
-        if "does not exist" in str(e):
-            logging.info(f"Backup table '{BACKUP_TABLE}' does not exist. Returning empty set.")
-            backup_ids = set()
+        return orjson.dumps(value)
+    except TypeError:
+        return json.dumps(value).encode()
+
+def _json_loads(text):
+    """
+    Parse JSON text with orjson unless it may hold integers beyond 64 bits.
+    """
+    if _LONG_DIGITS.search(text):
+        return json.loads(text)
+    return orjson.loads(text)
+
+# Fixed pieces of PostgreSQL's binary COPY format: the signature, flags and
+# header extension length, the end-of-data marker, and the per-field prefixes
+# used by _copy_binary_buffer.
+_COPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack("!ii", 0, 0)
+_COPY_TRAILER = struct.pack("!h", -1)
+_COPY_NULL = struct.pack("!i", -1)
+_pack_row_start = struct.Struct("!hi").pack
+_pack_length = struct.Struct("!i").pack
+_pack_jsonb_start = struct.Struct("!ib").pack
+
+def _copy_binary_buffer(rows):
+    """
+    Encode (id, embedding, metadata, document) rows in PostgreSQL's binary COPY
+    format. Specialized for the staging table's four columns: TEXT, BYTEA,
+    JSONB (version byte 1 followed by JSON bytes) and nullable TEXT.
+    """
+    buf = io.BytesIO()
+    write = buf.write
+    write(_COPY_HEADER)
+    for id_val, embedding, metadata, document in rows:
+        id_bytes = id_val.encode()
+        write(_pack_row_start(4, len(id_bytes)))
+        write(id_bytes)
+        if embedding is None:
+            write(_COPY_NULL)
         else:
-            logging.error(f"Error fetching backup IDs: {e}")
-            backup_ids = set()
-    finally:
-        try:
-            if cur:
-                cur.close()
-            if conn:
-                conn.close()
-        except Exception:
-            pass
-    return backup_ids
+            write(_pack_length(len(embedding)))
+            write(embedding)
+        write(_pack_jsonb_start(len(metadata) + 1, 1))
+        write(metadata)
+        if document is None:
+            write(_COPY_NULL)
+        else:
+            document_bytes = document.encode()
+            write(_pack_length(len(document_bytes)))
+            write(document_bytes)
+    write(_COPY_TRAILER)
+    buf.seek(0)
+    return buf
 
-def export_collection_to_postgres():
+# Leading byte of every stored embedding, recording how the rest is encoded.
+_EMBEDDING_FLOAT32 = b"\x01"
+_EMBEDDING_INT8 = b"\x02"
+
+def _encode_embedding(embedding):
     """
-    Exports new records from the remote vector DB's collection to PostgreSQL.
-    Only records with IDs not already in the backup table are inserted.
+    Pack an embedding for the BYTEA column: a format tag followed by raw
+    little-endian float32 values, or, with BACKUP_QUANTIZE=int8, a tag, a
+    float32 scale and one int8 per component.
+    """
+    if embedding is None:
+        return None
+    vector = np.asarray(embedding, dtype="<f4")
+    if BACKUP_QUANTIZE == "int8":
+        scale = np.float32(np.abs(vector).max()) if vector.size else np.float32(0)
+        if scale == 0:
+            quantized = np.zeros(vector.shape, dtype=np.int8)
+        else:
+            quantized = np.round(vector / scale * 127).astype(np.int8)
+        return _EMBEDDING_INT8 + np.array(scale, dtype="<f4").tobytes() + quantized.tobytes()
+    return _EMBEDDING_FLOAT32 + vector.tobytes()
+
+def _encode_embeddings(embeddings):
+    """
+    Batch version of _encode_embedding. When all vectors share a dimension the
+    whole batch is converted and quantized with a single set of numpy calls;
+    otherwise (missing or ragged vectors) each one is encoded on its own.
     """
-    logging.info("Starting export process ...")
-    base_url = get_base_url()
-    get_url = f"{base_url}/api/v1/vector_db/collections/{CHROMA_COLLECTION_NAME}/embeddings"
-    
     try:
-        response = requests.get(get_url, headers={"accept": "application/json"})
-        if response.status_code != 200:
-            logging.error(f"Failed to retrieve embeddings from collection '{CHROMA_COLLECTION_NAME}'. Status: {response.status_code}")
-            return
-        # The API now returns a dict with keys: "ids", "embeddings", "metadatas", "documents", etc.
-        data = response.json()
-        logging.info(f"Retrieved data keys: {list(data.keys())} from collection '{CHROMA_COLLECTION_NAME}'.")
-    except Exception as e:
-        logging.error(f"Error retrieving data from remote API: {e}")
-        return
+        matrix = np.asarray(embeddings, dtype="<f4")
+    except (TypeError, ValueError):
+        matrix = None
+    if matrix is None or matrix.ndim != 2:
+        return [_encode_embedding(embedding) for embedding in embeddings]
+    if BACKUP_QUANTIZE == "int8":
+        scales = np.abs(matrix).max(axis=1) if matrix.shape[1] else np.zeros(len(matrix), dtype="<f4")
+        divisors = np.where(scales == 0, np.float32(1), scales)
+        quantized = np.round(matrix / divisors[:, None] * 127).astype(np.int8)
+        return [_EMBEDDING_INT8 + scale.tobytes() + row.tobytes() for scale, row in zip(scales.astype("<f4"), quantized)]
+    return [_EMBEDDING_FLOAT32 + row.tobytes() for row in matrix]
 
-    # Extract lists from the returned data
-    ids_list = data.get("ids", [])
-    embeddings_list = data.get("embeddings", [])
-    metadatas_list = data.get("metadatas", [])
-    documents_list = data.get("documents", [])
-    
-    logging.info(f"IDs count: {len(ids_list)}, embeddings count: {len(embeddings_list)}, metadatas count: {len(metadatas_list)}, documents count: {len(documents_list)}")
-    
-    # Get IDs already backed up.
-    backup_ids = get_backup_ids()
-    new_rows = []
-    for i, id_val in enumerate(ids_list):
-        if id_val not in backup_ids:
-            embedding = embeddings_list[i] if i < len(embeddings_list) else None
-            metadata = metadatas_list[i] if i < len(metadatas_list) else None
-            document = documents_list[i] if i < len(documents_list) else None
-            new_rows.append((id_val, json.dumps(embedding), json.dumps(metadata), document))
-            logging.info(f"Adding new record: {id_val}")
+def _decode_embedding(value):
+    """
+    Unpack an embedding stored by _encode_embedding back into a list of floats,
+    using the format tag it was stored with. Values from tables created with
+    the older JSONB column are returned as-is.
+    """
+    if isinstance(value, (bytes, memoryview)):
+        value = bytes(value)
+        tag = value[:1]
+        if tag == _EMBEDDING_FLOAT32:
+            return np.frombuffer(value, dtype="<f4", offset=1).tolist()
+        if tag == _EMBEDDING_INT8:
+            scale = np.frombuffer(value, dtype="<f4", count=1, offset=1)[0]
+            quantized = np.frombuffer(value, dtype=np.int8, offset=5)
+            return (quantized.astype(np.float32) * (scale / 127)).tolist()
+        raise ValueError(f"Unknown embedding format tag {tag!r}")
+    if value and isinstance(value, str):
+        return orjson.loads(value)
+    return value
 
-    if not new_rows:
-        logging.info("No new records to export.")
+def _migrate_jsonb_embeddings(cur):
+    """
+    Convert a backup table created with the older JSONB embedding column to
+    the BYTEA format in place. Runs in the caller's transaction, which should
+    be committed straight after. Does nothing if the table does not exist yet
+    or has already been converted.
+    """
+    cur.execute("""
+        SELECT data_type FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = %s AND column_name = 'embedding';
+    """, (BACKUP_TABLE,))
+    row = cur.fetchone()
+    if not row or row[0] != "jsonb":
         return
+    logging.info(f"Converting JSONB embeddings in backup table '{BACKUP_TABLE}' to BYTEA ...")
+    # The staging table was created LIKE the old layout, so rebuild it too.
+    cur.execute(f"""
+        ALTER TABLE {BACKUP_TABLE} RENAME COLUMN embedding TO embedding_jsonb;
+        ALTER TABLE {BACKUP_TABLE} ADD COLUMN embedding BYTEA;
+        DROP TABLE IF EXISTS {BACKUP_TABLE}_stage;
+    """)
+    converted = 0
+    with cur.connection.cursor(name="migrate_cur") as read_cur:
+        read_cur.execute(f"SELECT id, embedding_jsonb FROM {BACKUP_TABLE} WHERE embedding_jsonb IS NOT NULL;")
+        rows = read_cur.fetchmany(1000)
+        while rows:
+            cur.execute(f"""
+                UPDATE {BACKUP_TABLE} AS b SET embedding = u.embedding
+                FROM unnest(%s::text[], %s::bytea[]) AS u(id, embedding)
+                WHERE b.id = u.id;
+            """, ([row[0] for row in rows], _encode_embeddings([row[1] for row in rows])))
+            converted += len(rows)
+            rows = read_cur.fetchmany(1000)
+    cur.execute(f"ALTER TABLE {BACKUP_TABLE} DROP COLUMN embedding_jsonb;")
+    logging.info(f"Converted {converted} embeddings in backup table '{BACKUP_TABLE}'.")
 
-    # Ensure backup table exists.
-    conn = None
-    cur = None
-    try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        create_table_query = f"""
-        CREATE TABLE IF NOT EXISTS {BACKUP_TABLE} (
-            id TEXT PRIMARY KEY,
-            embedding JSONB,
-            metadata JSONB,
-            document TEXT
-        );
-        """
-        cur.execute(create_table_query)
-        conn.commit()
-        logging.info(f"Ensured backup table '{BACKUP_TABLE}' exists.")
-    except Exception as e:
-        logging.error(f"Error ensuring backup table exists: {e}")
-        return
+def _select_new_ids(cur, ids_list):
+    """
+    Return the subset of ids_list not yet present in the backup table.
+    The IDs are sent as a single array parameter and diffed server-side,
+    so the backup table's IDs never have to be fetched.
+    """
+    cur.execute(f"""
+        SELECT i.id FROM unnest(%s::text[]) AS i(id)
+        LEFT JOIN {BACKUP_TABLE} b ON b.id = i.id
+        WHERE b.id IS NULL;
+    """, (ids_list,))
+    return set(row[0] for row in cur.fetchall())
 
-    try:
-        upsert_query = f"""
+def _read_new_records(stream, select_new):
+    """
+    Stream-parse an embeddings response of the form
+    {"ids": [...], "embeddings": [...], "metadatas": [...], "documents": [...]}
+    and return the number of IDs in the response, the highest
+    EXPORT_WATERMARK_KEY metadata value seen (or None), and the four lists
+    restricted to the records whose IDs are selected by select_new.
+    IDs are returned as strings, and records with a null ID are dropped.
+    Once the ids column has been read, items of the other columns belonging
+    to already backed-up records are skipped without being built.
+    """
+    columns = {"ids": [], "embeddings": [], "metadatas": [], "documents": []}
+    positions = dict.fromkeys(columns, 0)
+    keep = None
+    builder = None
+    watermark_prefix = f"metadatas.item.{EXPORT_WATERMARK_KEY}" if EXPORT_WATERMARK_KEY else None
+    watermark = None
+    for prefix, event, value in ijson.parse(stream, use_float=True):
+        if prefix == watermark_prefix and event in ("number", "string"):
+            try:
+                if watermark is None or value > watermark:
+                    watermark = value
+            except TypeError:
+                pass
+        name, _, rest = prefix.partition(".")
+        if name not in columns:
+            continue
+        if builder is not None:
+            builder.event(event, value)
+            if rest == "item" and event in ("end_map", "end_array"):
+                columns[name].append(builder.value)
+                positions[name] += 1
+                builder = None
+            continue
+        if rest == "" and event == "end_array" and name == "ids":
+            # The backup table keys on TEXT, so compare IDs in that form.
+            columns["ids"] = [None if id_val is None else str(id_val) for id_val in columns["ids"]]
+            if None in columns["ids"]:
+                logging.warning(f"Skipping {columns['ids'].count(None)} records with a null ID.")
+            present = [id_val for id_val in columns["ids"] if id_val is not None]
+            new_ids = select_new(present) if present else set()
+            keep = [id_val is not None and id_val in new_ids for id_val in columns["ids"]]
+            # Apply the mask to any column that arrived ahead of the ids.
+            for key, items in columns.items():
+                columns[key] = [item for item, wanted in zip(items, keep) if wanted]
+            logging.info(f"Streamed {len(keep)} IDs from collection '{CHROMA_COLLECTION_NAME}', {len(new_ids)} to back up.")
+            continue
+        if rest != "item" or event == "map_key":
+            continue
+        if event in ("end_map", "end_array"):
+            # End of a skipped item.
+            positions[name] += 1
+            continue
+        index = positions[name]
+        wanted = name == "ids" or keep is None or (index < len(keep) and keep[index])
+        if event in ("start_map", "start_array"):
+            if wanted:
+                builder = ObjectBuilder()
+                builder.event(event, value)
+            continue
+        if wanted:
+            columns[name].append(value)
+        positions[name] += 1
+    if keep is None:
+        return 0, watermark, [], [], [], []
+    return len(keep), watermark, columns["ids"], columns["embeddings"], columns["metadatas"], columns["documents"]
+
+# Set once the Content-Encoding of an embeddings response has been logged.
+_ENCODING_LOGGED = False
+
+def _fetch_page(params, select_new):
+    """
+    Fetch one page of the collection and stream-parse it with _read_new_records.
+    """
+    global _ENCODING_LOGGED
+    with _SESSION.get(_GET_URL, params=params, stream=True) as response:
+        response.raise_for_status()
+        if not _ENCODING_LOGGED:
+            _ENCODING_LOGGED = True
+            logging.info(f"Embeddings responses use Content-Encoding: {response.headers.get('Content-Encoding', 'identity')}.")
+        response.raw.decode_content = True
+        return _read_new_records(response.raw, select_new)
+
+# Whether COPY FROM STDIN works for this user; probed once per process.
+_COPY_SUPPORTED = None
+
+def _copy_supported(cur):
+    """
+    Check, once, whether COPY into the staging table is permitted by trying an
+    empty COPY inside a savepoint. Only a refusal for lack of privilege or
+    support is remembered; any other error falls back to batched upserts for
+    the current export and the probe runs again next time.
+    """
+    global _COPY_SUPPORTED
+    if _COPY_SUPPORTED is None:
+        cur.execute("SAVEPOINT copy_probe;")
+        try:
+            cur.copy_expert(f"COPY {BACKUP_TABLE}_stage (id) FROM STDIN", io.StringIO(""))
+            cur.execute("RELEASE SAVEPOINT copy_probe;")
+            _COPY_SUPPORTED = True
+        except (InsufficientPrivilege, FeatureNotSupported) as e:
+            cur.execute("ROLLBACK TO SAVEPOINT copy_probe;")
+            logging.warning(f"COPY is not available ({e}). Falling back to batched upserts.")
+            _COPY_SUPPORTED = False
+        except psycopg2.Error as e:
+            cur.execute("ROLLBACK TO SAVEPOINT copy_probe;")
+            logging.warning(f"COPY probe failed ({e}). Using batched upserts for this export.")
+            return False
+    return _COPY_SUPPORTED
+
+def _write_new_rows(cur, use_copy, ids_list, embeddings_list, metadatas_list, documents_list):
+    """
+    Serialize a batch of new records and write them out: COPY them into the
+    staging table, or, when COPY is unavailable, upsert them straight into the
+    backup table with execute_batch. Returns the number of rows written.
+    """
+    columns = (_encode_embeddings(embeddings_list), metadatas_list, documents_list)
+    if any(len(column) != len(ids_list) for column in columns):
+        logging.warning(
+            f"Column lengths differ (ids: {len(ids_list)}, embeddings: {len(columns[0])}, "
+            f"metadatas: {len(columns[1])}, documents: {len(columns[2])}); missing values are stored as null."
+        )
+    new_rows = [
+        (id_val, embedding, _json_dumps(metadata), document)
+        for id_val, embedding, metadata, document in islice(zip_longest(ids_list, *columns), len(ids_list))
+    ]
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug(f"Adding new records: {', '.join(str(row[0]) for row in new_rows)}")
+
+    if not new_rows:
+        return 0
+
+    if use_copy:
+        cur.copy_expert(
+            f"COPY {BACKUP_TABLE}_stage (id, embedding, metadata, document) FROM STDIN WITH (FORMAT binary)",
+            _copy_binary_buffer(new_rows)
+        )
+    else:
+        upsert_row_query = f"""
         INSERT INTO {BACKUP_TABLE} (id, embedding, metadata, document)
-        VALUES %s
+        VALUES (%s, %s, %s, %s)
         ON CONFLICT (id)
         DO UPDATE SET
           embedding = EXCLUDED.embedding,
           metadata = EXCLUDED.metadata,
           document = EXCLUDED.document;
         """
-        execute_values(cur, upsert_query, new_rows)
-        conn.commit()
-        logging.info(f"Exported {len(new_rows)} new records to backup table '{BACKUP_TABLE}'.")
-    except Exception as e:
-        logging.error(f"Error upserting records: {e}")
-    finally:
-        try:
-            if cur:
-                cur.close()
-            if conn:
-                conn.close()
-        except Exception:
-            pass
+        execute_batch(
+            cur,
+            upsert_row_query,
+            [(id_val, embedding, metadata.decode(), document) for id_val, embedding, metadata, document in new_rows],
+            page_size=UPSERT_PAGE_SIZE
+        )
+    return len(new_rows)
 
-def import_postgres_to_chroma():
+def export_collection_to_postgres():
     """
-    Imports all backed-up records from PostgreSQL into a new collection
-    in the remote vector DB.
+    Exports new records from the remote vector DB's collection to PostgreSQL.
+    Only records with IDs not already in the backup table are inserted, except
+    in incremental mode, where records modified since the last export are
+    upserted as well.
     """
-    logging.info("Starting import process ...")
+    logging.info("Starting export process ...")
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute(f"SELECT id, embedding, metadata, document FROM {BACKUP_TABLE};")
-        rows = cur.fetchall()
-        logging.info(f"Fetched {len(rows)} records from backup table '{BACKUP_TABLE}'.")
-    except Exception as e:
-        logging.error(f"Error fetching backup data: {e}")
-        return
-    finally:
-        try:
-            cur.close()
-            conn.close()
-        except Exception:
-            pass
+        with get_db_connection() as conn, conn.cursor() as cur:
+            # The conversion takes an exclusive lock on the backup table, so it
+            # is committed on its own rather than held for the whole export,
+            # and a failed export does not undo it.
+            _migrate_jsonb_embeddings(cur)
+            conn.commit()
+            # Ensure backup table and its staging table exist, and empty the
+            # staging table. Everything is sent in one round trip and the whole
+            # export runs in a single transaction.
+            setup_query = f"""
+            CREATE TABLE IF NOT EXISTS {BACKUP_TABLE} (
+                id TEXT PRIMARY KEY,
+                embedding BYTEA,
+                metadata JSONB,
+                document TEXT
+            );
+            CREATE UNLOGGED TABLE IF NOT EXISTS {BACKUP_TABLE}_stage (LIKE {BACKUP_TABLE});
+            TRUNCATE {BACKUP_TABLE}_stage;
+            CREATE TABLE IF NOT EXISTS backup_state (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+            """
+            cur.execute(setup_query)
+            logging.info(f"Ensured backup table '{BACKUP_TABLE}' exists.")
+            use_copy = _copy_supported(cur)
 
-    if not rows:
-        logging.info("No backup data found to import.")
-        return
+            # Only ask for records modified since the previous export, if
+            # incremental export is enabled and a previous export of this
+            # collection recorded a watermark. Otherwise the whole collection
+            # is scanned.
+            watermark_state_key = f"{BACKUP_TABLE}.{CHROMA_COLLECTION_NAME}.{EXPORT_WATERMARK_KEY}.last_export_ts"
+            last_ts = None
+            if EXPORT_WATERMARK_KEY:
+                cur.execute("SELECT value FROM backup_state WHERE key = %s;", (watermark_state_key,))
+                row = cur.fetchone()
+                last_ts = row[0] if row else None
+            if last_ts is not None:
+                # A watermark outliving an emptied backup table would skip
+                # everything exported before it.
+                cur.execute(f"SELECT EXISTS (SELECT 1 FROM {BACKUP_TABLE});")
+                if not cur.fetchone()[0]:
+                    logging.info(f"Backup table '{BACKUP_TABLE}' is empty; ignoring the stored watermark.")
+                    last_ts = None
+            since = {"modified_since": last_ts} if last_ts is not None else {}
+            if since:
+                logging.info(f"Exporting records modified since {last_ts}.")
 
-    # Prepare payload for adding embeddings.
-    embeddings_payload = []
-    for row in rows:
-        id_val, emb_json, meta_json, doc = row
-        try:
-            if emb_json and isinstance(emb_json, str):
-                embedding = json.loads(emb_json)
-            else:
-                embedding = emb_json
-            if meta_json and isinstance(meta_json, str):
-                metadata = json.loads(meta_json)
-            else:
-                metadata = meta_json
-        except Exception as e:
-            logging.error(f"Error parsing JSON for record {id_val}: {e}")
-            continue
-        embeddings_payload.append({
-            "id": id_val,
-            "embedding": embedding,
-            "metadata": metadata,
-            "document": doc
-        })
-
-    base_url = get_base_url()
-    # Create new collection.
-    create_url = f"{base_url}/api/v1/vector_db/collections"
-    try:
-        response = requests.post(create_url, json={"name": NEW_COLLECTION_NAME}, headers={"accept": "application/json"})
-        if response.status_code == 200:
-            logging.info(f"Created collection '{NEW_COLLECTION_NAME}'.")
-        else:
-            logging.warning(f"Collection '{NEW_COLLECTION_NAME}' creation returned status {response.status_code}. Proceeding with adding embeddings.")
+            # Pages are parsed on worker threads while this thread writes
+            # earlier pages. psycopg2 does not hold the connection lock for the
+            # whole of a COPY, so every use of the connection while workers
+            # are running goes through this lock.
+            conn_lock = threading.Lock()
+
+            def select_new(ids):
+                if since:
+                    # Every record returned was modified since the last
+                    # export, so rewrite it even if it is already backed up.
+                    return set(ids)
+                with conn_lock, conn.cursor() as page_cur:
+                    return _select_new_ids(page_cur, ids)
+
+            # Stream the collection, a page per worker when paging is enabled, and
+            # write the new records of each page from this thread as the pages
+            # complete.
+            exported = 0
+            max_ts = None
+            executor = ThreadPoolExecutor(max_workers=EXPORT_WORKERS if EXPORT_PAGE_SIZE > 0 else 1)
+            try:
+                if EXPORT_PAGE_SIZE > 0:
+                    pending = {
+                        executor.submit(_fetch_page, {**since, "offset": k * EXPORT_PAGE_SIZE, "limit": EXPORT_PAGE_SIZE}, select_new)
+                        for k in range(EXPORT_WORKERS)
+                    }
+                    next_offset = EXPORT_WORKERS * EXPORT_PAGE_SIZE
+                else:
+                    pending = {executor.submit(_fetch_page, since, select_new)}
+                more_pages = EXPORT_PAGE_SIZE > 0
+                while pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        page_total, page_ts, *columns = future.result()
+                        if page_ts is not None:
+                            try:
+                                if max_ts is None or page_ts > max_ts:
+                                    max_ts = page_ts
+                            except TypeError:
+                                pass
+                        # A short page marks the end of the collection.
+                        if more_pages and page_total == EXPORT_PAGE_SIZE:
+                            pending.add(executor.submit(
+                                _fetch_page, {**since, "offset": next_offset, "limit": EXPORT_PAGE_SIZE}, select_new
+                            ))
+                            next_offset += EXPORT_PAGE_SIZE
+                        else:
+                            more_pages = False
+                        with conn_lock:
+                            exported += _write_new_rows(cur, use_copy, *columns)
+            finally:
+                executor.shutdown(cancel_futures=True)
+
+            if max_ts is not None:
+                cur.execute("""
+                INSERT INTO backup_state (key, value) VALUES (%s, %s)
+                ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value;
+                """, (watermark_state_key, str(max_ts)))
+
+            if not exported:
+                conn.commit()
+                logging.info("No new records to export.")
+                return
+
+            if use_copy:
+                # Merge the staged rows into the backup table in a single
+                # statement. Pages can overlap if the collection changes
+                # mid-export, so keep one row per id.
+                upsert_query = f"""
+                INSERT INTO {BACKUP_TABLE} (id, embedding, metadata, document)
+                SELECT DISTINCT ON (id) id, embedding, metadata, document FROM {BACKUP_TABLE}_stage
+                ON CONFLICT (id)
+                DO UPDATE SET
+                  embedding = EXCLUDED.embedding,
+                  metadata = EXCLUDED.metadata,
+                  document = EXCLUDED.document;
+                """
+                cur.execute(upsert_query)
+            conn.commit()
+            logging.info(f"Exported {exported} records to backup table '{BACKUP_TABLE}'.")
+    except (requests.RequestException, ijson.JSONError) as e:
+        logging.error(f"Error retrieving data from remote API: {e}")
     except Exception as e:
-        logging.error(f"Error creating collection '{NEW_COLLECTION_NAME}': {e}")
-        return
+        logging.error(f"Error exporting records to backup table '{BACKUP_TABLE}': {e}")
 
-    # Add embeddings to the new collection.
-    add_url = f"{base_url}/api/v1/vector_db/collections/{NEW_COLLECTION_NAME}/add_embeddings"
+def _decode_row(row):
+    """
+    Turn a backup table row into an add_embeddings record.
+    Returns None if the row cannot be decoded.
+    """
+    id_val, emb_value, meta_json, doc = row
     try:
-        response = requests.post(add_url, json=embeddings_payload, headers={"accept": "application/json", "Content-Type": "application/json"})
-        if response.status_code == 200:
-            logging.info(f"Imported {len(embeddings_payload)} records into new collection '{NEW_COLLECTION_NAME}'.")
+        embedding = _decode_embedding(emb_value)
+        if meta_json and isinstance(meta_json, str):
+            metadata = _json_loads(meta_json)
         else:
-            logging.error(f"Failed to import embeddings. Status: {response.status_code}. Response: {response.text}")
+            metadata = meta_json
     except Exception as e:
+        logging.error(f"Error decoding record {id_val}: {e}")
+        return None
+    return {
+        "id": id_val,
+        "embedding": embedding,
+        "metadata": metadata,
+        "document": doc
+    }
+
+def _post_batch(batch):
+    """
+    POST one batch of records to the add_embeddings endpoint.
+    Returns the number of records sent; raises on a non-200 response.
+    """
+    response = _SESSION.post(_ADD_URL, data=_json_dumps(batch), headers={"Content-Type": "application/json"})
+    if response.status_code != 200:
+        raise requests.HTTPError(
+            f"Failed to import embeddings. Status: {response.status_code}. Response: {response.text}",
+            response=response
+        )
+    return len(batch)
+
+def import_postgres_to_chroma():
+    """
+    Imports all backed-up records from PostgreSQL into a new collection
+    in the remote vector DB. Rows are streamed from a server-side cursor and
+    sent in batches of IMPORT_BATCH_SIZE, up to IMPORT_WORKERS at a time, so
+    memory use is bounded by the batches in flight rather than the size of
+    the backup.
+    """
+    logging.info("Starting import process ...")
+    imported = 0
+    try:
+        with get_db_connection() as conn, conn.cursor(name="import_cur") as cur:
+            # Decode the metadata column with orjson on this cursor only.
+            register_default_jsonb(conn_or_curs=cur, loads=_json_loads)
+            cur.execute(f"SELECT id, embedding, metadata, document FROM {BACKUP_TABLE};")
+            rows = cur.fetchmany(IMPORT_BATCH_SIZE)
+            if not rows:
+                logging.info("No backup data found to import.")
+                return
+
+            # Create new collection.
+            try:
+                response = _SESSION.post(_CREATE_URL, json={"name": NEW_COLLECTION_NAME})
+                if response.status_code == 200:
+                    logging.info(f"Created collection '{NEW_COLLECTION_NAME}'.")
+                else:
+                    logging.warning(f"Collection '{NEW_COLLECTION_NAME}' creation returned status {response.status_code}. Proceeding with adding embeddings.")
+            except Exception as e:
+                logging.error(f"Error creating collection '{NEW_COLLECTION_NAME}': {e}")
+                return
+
+            # Add embeddings to the new collection, keeping several batches
+            # in flight while the next ones are read from the cursor.
+            executor = ThreadPoolExecutor(max_workers=IMPORT_WORKERS)
+            pending = set()
+            try:
+                while rows or pending:
+                    batch = [record for record in map(_decode_row, rows) if record is not None]
+                    if batch:
+                        pending.add(executor.submit(_post_batch, batch))
+                    if len(pending) >= IMPORT_WORKERS or (pending and not rows):
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            imported += future.result()
+                        logging.info(f"Imported {imported} records so far into collection '{NEW_COLLECTION_NAME}'.")
+                    if rows:
+                        rows = cur.fetchmany(IMPORT_BATCH_SIZE)
+            finally:
+                executor.shutdown(cancel_futures=True)
+        logging.info(f"Imported {imported} records into new collection '{NEW_COLLECTION_NAME}'.")
+    except requests.RequestException as e:
         logging.error(f"Error importing records into collection '{NEW_COLLECTION_NAME}': {e}")
+    except Exception as e:
+        logging.error(f"Error fetching backup data: {e}")
 
 def check_collection_health():
     """
@@ -237,10 +657,8 @@ def check_collection_health():
     If retrieval fails, trigger an import from backup.
     """
     logging.info("Performing health check on primary collection ...")
-    base_url = get_base_url()
-    health_url = f"{base_url}/api/v1/vector_db/collections/{CHROMA_COLLECTION_NAME}/embeddings"
     try:
-        response = requests.get(health_url, headers={"accept": "application/json"})
+        response = _SESSION.get(_GET_URL)
         if response.status_code == 200:
             logging.info(f"Collection '{CHROMA_COLLECTION_NAME}' is healthy.")
         else:
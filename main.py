@@ -1,6 +1,6 @@
-import time
-import schedule
 import logging
+from apscheduler.executors.pool import ThreadPoolExecutor
+from apscheduler.schedulers.blocking import BlockingScheduler
 from export_import import export_collection_to_postgres, check_collection_health
 
 # Configure logging for the main scheduler as well.
@@ -12,16 +12,18 @@ logging.basicConfig(
 
 def run_scheduler():
     logging.info("Scheduler starting. Scheduling tasks ...")
+    # The scheduler sleeps until the next job is due instead of polling. A
+    # single worker thread keeps jobs serial, so a health check cannot start
+    # an import while an export is running.
+    scheduler = BlockingScheduler(executors={"default": ThreadPoolExecutor(1)})
     # Schedule export to run hourly.
-    schedule.every(1).hours.do(export_collection_to_postgres)
+    scheduler.add_job(export_collection_to_postgres, "interval", hours=1)
     logging.info("Scheduled export task every 1 hour.")
     # Schedule health check every 20 minutes.
-    schedule.every(20).minutes.do(check_collection_health)
+    scheduler.add_job(check_collection_health, "interval", minutes=20)
     logging.info("Scheduled health check task every 20 minutes.")
 
-    while True:
-        schedule.run_pending()
-        time.sleep(1)
+    scheduler.start()
 
 if __name__ == "__main__":
     export_collection_to_postgres()
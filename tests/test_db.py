@@ -0,0 +1,56 @@
+import psycopg2
+
+import db
+
+
+class FakePoolConnection:
+    def __init__(self, alive):
+        self.alive = alive
+        self.closed = 0
+
+    def cursor(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def execute(self, query):
+        if not self.alive:
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+
+    def rollback(self):
+        pass
+
+
+class FakePool:
+    """
+    Hands out the given idle connections first, then new live ones.
+    """
+
+    maxconn = 8
+
+    def __init__(self, idle):
+        self.idle = list(idle)
+        self.discarded = []
+        self.returned = []
+
+    def getconn(self):
+        return self.idle.pop(0) if self.idle else FakePoolConnection(alive=True)
+
+    def putconn(self, conn, close=False):
+        (self.discarded if close else self.returned).append(conn)
+
+
+def test_stale_pooled_connections_are_replaced(monkeypatch):
+    stale = [FakePoolConnection(alive=False), FakePoolConnection(alive=False)]
+    pool = FakePool(stale)
+    monkeypatch.setattr(db, "_get_pool", lambda: pool)
+
+    with db.get_db_connection() as conn:
+        assert conn.alive
+
+    assert pool.discarded == stale
+    assert pool.returned == [conn]
@@ -0,0 +1,429 @@
+import io
+import threading
+import time
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import psycopg2
+import pytest
+
+import export_import
+
+
+class OwnedLock:
+    """
+    Stands in for threading.Lock inside export_import and records which
+    thread holds it, so tests can check what runs under the lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.owner = None
+
+    def __enter__(self):
+        self._lock.acquire()
+        self.owner = threading.get_ident()
+        return self
+
+    def __exit__(self, *exc):
+        self.owner = None
+        self._lock.release()
+
+
+class FakeCursor:
+    """
+    Stands in for a psycopg2 cursor. Every statement records the thread it
+    ran on and whether that thread held the export's connection lock.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.connection = conn
+        self.params = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        pass
+
+    def _record(self, kind):
+        held = any(lock.owner == threading.get_ident() for lock in self.conn.locks)
+        self.conn.statements.append((kind, threading.get_ident(), held))
+
+    def execute(self, query, params=None):
+        self.params = params
+        self.conn.log.append((query, params))
+        self._record("execute")
+
+    def fetchone(self):
+        query = self.conn.log[-1][0]
+        if "FROM backup_state" in query:
+            value = self.conn.state.get(self.params[0])
+            return (value,) if value is not None else None
+        if "SELECT EXISTS" in query:
+            return (self.conn.backed_up,)
+        # Report a JSONB embedding column only if legacy rows were given.
+        return ("jsonb",) if self.conn.legacy_rows is not None else None
+
+    def fetchmany(self, size):
+        rows = self.conn.legacy_rows[:size]
+        del self.conn.legacy_rows[:size]
+        return rows
+
+    def fetchall(self):
+        # Every ID diffed is reported as not backed up yet.
+        return [(id_val,) for id_val in self.params[0]]
+
+    def copy_expert(self, query, buf):
+        self._record("copy")
+        if self.conn.copy_error is not None:
+            raise self.conn.copy_error
+        self.conn.copies.append(buf.read())
+
+
+class FakeConnection:
+    def __init__(self, legacy_rows=None, copy_error=None):
+        self.legacy_rows = legacy_rows
+        self.copy_error = copy_error
+        self.state = {}
+        self.backed_up = True
+        self.log = []
+        self.locks = []
+        self.statements = []
+        self.copies = []
+        self.committed = False
+
+    def cursor(self, name=None):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.committed = True
+        self.log.append(("COMMIT", None))
+
+
+def test_paged_export_serializes_connection_use(monkeypatch):
+    conn = FakeConnection()
+    total = 40
+
+    @contextmanager
+    def fake_get_db_connection():
+        yield conn
+
+    def fake_fetch_page(params, select_new):
+        offset, limit = params["offset"], params["limit"]
+        ids = [f"id{i}" for i in range(offset, min(offset + limit, total))]
+        new_ids = select_new(ids) if ids else set()
+        new = [id_val for id_val in ids if id_val in new_ids]
+        return len(ids), None, new, [[0.5, -1.0]] * len(new), [{}] * len(new), [None] * len(new)
+
+    def make_lock():
+        lock = OwnedLock()
+        conn.locks.append(lock)
+        return lock
+
+    monkeypatch.setattr(export_import, "threading", SimpleNamespace(Lock=make_lock))
+    monkeypatch.setattr(export_import, "get_db_connection", fake_get_db_connection)
+    monkeypatch.setattr(export_import, "_fetch_page", fake_fetch_page)
+    monkeypatch.setattr(export_import, "_COPY_SUPPORTED", True)
+    monkeypatch.setattr(export_import, "EXPORT_PAGE_SIZE", 3)
+    monkeypatch.setattr(export_import, "EXPORT_WORKERS", 4)
+    monkeypatch.setattr(export_import, "EXPORT_WATERMARK_KEY", "")
+
+    export_import.export_collection_to_postgres()
+
+    main = threading.get_ident()
+    copies = [held for kind, _, held in conn.statements if kind == "copy"]
+    worker_statements = [held for _, thread, held in conn.statements if thread != main]
+    assert len(copies) == (total + 2) // 3
+    assert worker_statements
+    # Worker diffs and the COPYs must never use the connection unlocked.
+    assert all(copies) and all(worker_statements)
+    assert conn.committed
+
+
+def test_embeddings_decode_by_stored_format(monkeypatch):
+    vector = [0.5, -1.25, 0.0, 3.0]
+    monkeypatch.setattr(export_import, "BACKUP_QUANTIZE", "int8")
+    quantized = export_import._encode_embeddings([vector])[0]
+    monkeypatch.setattr(export_import, "BACKUP_QUANTIZE", "")
+    full = export_import._encode_embeddings([vector])[0]
+
+    # Decoding must not depend on the current setting.
+    for setting in ("", "int8"):
+        monkeypatch.setattr(export_import, "BACKUP_QUANTIZE", setting)
+        assert export_import._decode_embedding(memoryview(full)) == vector
+        restored = export_import._decode_embedding(memoryview(quantized))
+        assert len(restored) == len(vector)
+        assert max(abs(a - b) for a, b in zip(restored, vector)) < 0.02
+
+
+def test_non_string_ids_are_compared_as_text():
+    body = b'{"ids": [5, "a", null, 7], "embeddings": [[1.0], [2.0], [3.0], [4.0]], "metadatas": null, "documents": null}'
+    seen = []
+
+    def select_new(ids):
+        seen.extend(ids)
+        return {"5", "a"}
+
+    count, _, ids, embeddings, _, _ = export_import._read_new_records(io.BytesIO(body), select_new)
+
+    assert count == 4
+    assert seen == ["5", "a", "7"]
+    assert ids == ["5", "a"]
+    assert embeddings == [[1.0], [2.0]]
+
+
+def test_watermark_is_the_highest_value_across_all_records(monkeypatch):
+    monkeypatch.setattr(export_import, "EXPORT_WATERMARK_KEY", "ts")
+    body = (
+        b'{"ids": ["a", "b", "c", "d"], "embeddings": [[1.0], [2.0], [3.0], [4.0]], '
+        b'"metadatas": [{"ts": 5}, {"ts": 12, "nested": {"ts": 99}}, {"other": 50}, {"ts": "late"}], '
+        b'"documents": null}'
+    )
+
+    # The highest value counts even for a record that is not written, while
+    # nested keys and values of another type are ignored.
+    _, watermark, ids, _, _, _ = export_import._read_new_records(io.BytesIO(body), lambda ids: {"a"})
+
+    assert ids == ["a"]
+    assert watermark == 12
+
+
+def _run_incremental_export(monkeypatch, conn):
+    params_seen = []
+
+    @contextmanager
+    def fake_get_db_connection():
+        yield conn
+
+    def fake_fetch_page(params, select_new):
+        params_seen.append(params)
+        ids = sorted(select_new(["a", "b"]))
+        return 2, 20, ids, [[0.5]] * len(ids), [{"ts": 20}] * len(ids), [None] * len(ids)
+
+    monkeypatch.setattr(export_import, "get_db_connection", fake_get_db_connection)
+    monkeypatch.setattr(export_import, "_fetch_page", fake_fetch_page)
+    monkeypatch.setattr(export_import, "_COPY_SUPPORTED", True)
+    monkeypatch.setattr(export_import, "EXPORT_PAGE_SIZE", 0)
+    monkeypatch.setattr(export_import, "EXPORT_WATERMARK_KEY", "ts")
+    export_import.export_collection_to_postgres()
+    return params_seen
+
+
+def test_incremental_export_upserts_modified_records_and_saves_watermark(monkeypatch):
+    conn = FakeConnection()
+    state_key = f"chroma_data.{export_import.CHROMA_COLLECTION_NAME}.ts.last_export_ts"
+    conn.state[state_key] = "10"
+
+    params_seen = _run_incremental_export(monkeypatch, conn)
+
+    assert params_seen == [{"modified_since": "10"}]
+    # Modified records are written without diffing them against the backup table.
+    assert not any("unnest" in query for query, _ in conn.log)
+    assert len(conn.copies) == 1
+    [params] = [params for query, params in conn.log if "INSERT INTO backup_state" in query]
+    assert params == (state_key, "20")
+    assert conn.committed
+
+
+def test_watermark_is_ignored_while_backup_table_is_empty(monkeypatch):
+    conn = FakeConnection()
+    conn.state[f"chroma_data.{export_import.CHROMA_COLLECTION_NAME}.ts.last_export_ts"] = "10"
+    conn.backed_up = False
+
+    params_seen = _run_incremental_export(monkeypatch, conn)
+
+    assert params_seen == [{}]
+    assert any("unnest" in query for query, _ in conn.log)
+
+
+def test_metadata_beyond_64_bits_is_kept_exact():
+    big = 2 ** 70
+    conn = FakeConnection()
+
+    written = export_import._write_new_rows(conn.cursor(), True, ["a"], [[1.0]], [{"n": big}], [None])
+
+    assert written == 1
+    assert str(big).encode() in conn.copies[0]
+    assert export_import._json_loads(f'{{"n": {big}}}') == {"n": big}
+    assert export_import._json_loads('{"n": 5}') == {"n": 5}
+
+
+def test_legacy_jsonb_embeddings_are_converted_in_their_own_transaction(monkeypatch):
+    conn = FakeConnection(legacy_rows=[("a", [0.5, -1.0]), ("b", None)])
+
+    @contextmanager
+    def fake_get_db_connection():
+        yield conn
+
+    monkeypatch.setattr(export_import, "get_db_connection", fake_get_db_connection)
+    monkeypatch.setattr(export_import, "_fetch_page", lambda params, select_new: (0, None, [], [], [], []))
+    monkeypatch.setattr(export_import, "_COPY_SUPPORTED", True)
+    monkeypatch.setattr(export_import, "EXPORT_PAGE_SIZE", 0)
+    monkeypatch.setattr(export_import, "EXPORT_WATERMARK_KEY", "")
+
+    export_import.export_collection_to_postgres()
+
+    queries = [query for query, _ in conn.log]
+    update = next(params for query, params in conn.log if query.strip().startswith("UPDATE"))
+    assert update[0] == ["a", "b"]
+    assert export_import._decode_embedding(update[1][0]) == [0.5, -1.0]
+    assert update[1][1] is None
+    drop = next(i for i, query in enumerate(queries) if "DROP COLUMN embedding_jsonb" in query)
+    setup = next(i for i, query in enumerate(queries) if "CREATE TABLE IF NOT EXISTS" in query)
+    # The conversion is committed before the export's own transaction starts.
+    assert "COMMIT" in queries[drop:setup]
+
+
+class FakeImportCursor:
+    """
+    Stands in for the import's server-side cursor, serving rows in batches
+    and recording how far reads ran ahead of completed POSTs.
+    """
+
+    def __init__(self, rows, posted):
+        self.rows = list(rows)
+        self.posted = posted
+        self.fetched_batches = 0
+        self.max_ahead = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def execute(self, query, params=None):
+        pass
+
+    def fetchmany(self, size):
+        self.max_ahead = max(self.max_ahead, self.fetched_batches - len(self.posted))
+        batch, self.rows = self.rows[:size], self.rows[size:]
+        if batch:
+            self.fetched_batches += 1
+        return batch
+
+
+def _run_import(monkeypatch, total, post_batch):
+    embedding = export_import._encode_embeddings([[0.5, -1.0]])[0]
+    posted = []
+    cur = FakeImportCursor([(f"id{i}", embedding, {"n": i}, None) for i in range(total)], posted)
+
+    @contextmanager
+    def fake_get_db_connection():
+        yield SimpleNamespace(cursor=lambda name=None: cur)
+
+    def fake_post(url, **kwargs):
+        return SimpleNamespace(status_code=200, text="")
+
+    monkeypatch.setattr(export_import, "get_db_connection", fake_get_db_connection)
+    monkeypatch.setattr(export_import, "register_default_jsonb", lambda **kwargs: None)
+    monkeypatch.setattr(export_import, "_SESSION", SimpleNamespace(post=fake_post))
+    monkeypatch.setattr(export_import, "_post_batch", lambda batch: post_batch(batch, posted))
+    monkeypatch.setattr(export_import, "IMPORT_BATCH_SIZE", 2)
+    monkeypatch.setattr(export_import, "IMPORT_WORKERS", 3)
+    export_import.import_postgres_to_chroma()
+    return cur, posted
+
+
+def test_import_bounds_batches_in_flight_and_drains(monkeypatch):
+    def post_batch(batch, posted):
+        time.sleep(0.002)
+        posted.append([record["id"] for record in batch])
+        return len(batch)
+
+    cur, posted = _run_import(monkeypatch, 25, post_batch)
+
+    # Every batch is sent, including the ones still in flight when the
+    # cursor runs out.
+    assert sorted(id_val for batch in posted for id_val in batch) == sorted(f"id{i}" for i in range(25))
+    assert cur.fetched_batches == 13
+    # The cursor is never read more than IMPORT_WORKERS batches ahead.
+    assert cur.max_ahead <= 3
+
+
+def test_import_stops_on_failed_batch(monkeypatch, caplog):
+    def post_batch(batch, posted):
+        posted.append(batch)
+        raise export_import.requests.HTTPError("Failed to import embeddings. Status: 500.")
+
+    cur, posted = _run_import(monkeypatch, 200, post_batch)
+
+    assert len(posted) <= 3
+    assert cur.fetched_batches <= 4
+    assert "Status: 500" in caplog.text
+
+
+def test_copy_binary_buffer_layout():
+    embedding = b"\x01\x00\x00\x80\x3f"
+    rows = [("a", embedding, b'{"k":1}', "doc"), ("\u00e9", None, b"null", None)]
+
+    data = export_import._copy_binary_buffer(rows).read()
+
+    header = b"PGCOPY\n\xff\r\n\x00" + b"\x00\x00\x00\x00" + b"\x00\x00\x00\x00"
+    assert len(header) == 19
+    assert data == (
+        header
+        # Row 1: field count, then length-prefixed id, embedding, JSONB
+        # (length includes the version byte) and document.
+        + b"\x00\x04"
+        + b"\x00\x00\x00\x01" + b"a"
+        + b"\x00\x00\x00\x05" + embedding
+        + b"\x00\x00\x00\x08" + b"\x01" + b'{"k":1}'
+        + b"\x00\x00\x00\x03" + b"doc"
+        # Row 2: UTF-8 id, NULL embedding and document as length -1.
+        + b"\x00\x04"
+        + b"\x00\x00\x00\x02" + "\u00e9".encode()
+        + b"\xff\xff\xff\xff"
+        + b"\x00\x00\x00\x05" + b"\x01" + b"null"
+        + b"\xff\xff\xff\xff"
+        # Trailer: a field count of -1.
+        + b"\xff\xff"
+    )
+
+
+@pytest.mark.parametrize("error, cached", [
+    (psycopg2.errors.InsufficientPrivilege("permission denied for table chroma_data_stage"), False),
+    (psycopg2.OperationalError("could not receive data from server"), None),
+])
+def test_export_falls_back_to_execute_batch_without_copy(monkeypatch, error, cached):
+    conn = FakeConnection(copy_error=error)
+    batches = []
+
+    @contextmanager
+    def fake_get_db_connection():
+        yield conn
+
+    def fake_fetch_page(params, select_new):
+        ids = sorted(select_new(["a", "b", "c"]))
+        return 3, None, ids, [[0.5, -1.0]] * 3, [{"n": 1}] * 3, ["doc", None, "doc"]
+
+    def fake_execute_batch(cur, query, argslist, page_size):
+        batches.append((query, argslist, page_size))
+
+    monkeypatch.setattr(export_import, "get_db_connection", fake_get_db_connection)
+    monkeypatch.setattr(export_import, "_fetch_page", fake_fetch_page)
+    monkeypatch.setattr(export_import, "execute_batch", fake_execute_batch)
+    monkeypatch.setattr(export_import, "_COPY_SUPPORTED", None)
+    monkeypatch.setattr(export_import, "EXPORT_PAGE_SIZE", 0)
+    monkeypatch.setattr(export_import, "EXPORT_WATERMARK_KEY", "")
+
+    export_import.export_collection_to_postgres()
+
+    # Only a permission or feature error is remembered for later exports.
+    assert export_import._COPY_SUPPORTED is cached
+    queries = [query for query, _ in conn.log]
+    assert "ROLLBACK TO SAVEPOINT copy_probe;" in queries
+    assert not any("DISTINCT ON" in query for query in queries)
+    [(query, argslist, page_size)] = batches
+    assert query.strip().startswith("INSERT INTO chroma_data")
+    assert page_size == export_import.UPSERT_PAGE_SIZE
+    assert [(id_val, metadata, document) for id_val, _, metadata, document in argslist] == [
+        ("a", '{"n":1}', "doc"), ("b", '{"n":1}', None), ("c", '{"n":1}', "doc")
+    ]
+    assert export_import._decode_embedding(argslist[0][1]) == [0.5, -1.0]
+    assert conn.committed